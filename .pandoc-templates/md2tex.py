@@ -3,176 +3,222 @@
 
 import re
 import sys
+from functools import lru_cache
+
+# Block-level splitter: one finditer over the whole document, branch on
+# ``lastgroup``. Line kinds are disjoint (decided by the first non-blank
+# character), so runs of tables, list items, blank lines and paragraphs are
+# grabbed as single blocks. ``_WS`` is whitespace that stays within a line.
+_WS = r'[^\S\n]'
+_TBL_LINE = rf'{_WS}*\|(?:[^\n]*\|)?{_WS}*'
+_HDR_LINE = rf'#{{1,4}}{_WS}+[^\n]+'
+_ITEM_LINE = rf'{_WS}*(?:[-*]|\d+\.){_WS}+[^\n]+'
+_IMG_LINE = rf'{_WS}*!\[[^\n]*?\]\([^\n]+?\){_WS}*'
+_RE_BLOCK = re.compile(
+    rf'(?P<tbl>(?:^{_TBL_LINE}$\n?)+)'
+    rf'|(?P<hdr>^(?P<hdr_level>#{{1,4}}){_WS}+(?P<hdr_text>[^\n]+)$\n?)'
+    rf'|(?P<list>(?:^{_ITEM_LINE}$\n?)+)'
+    rf'|(?P<img>^{_WS}*!\[[^\n]*?\]\((?P<img_src>[^\n]+?)\){_WS}*$\n?)'
+    rf'|(?P<blank>(?:^{_WS}*$\n?)+)'
+    rf'|(?P<para>(?:^(?!(?:{_WS}*|{_TBL_LINE}|{_HDR_LINE}|{_ITEM_LINE}|{_IMG_LINE})$)[^\n]+$\n?)+)',
+    re.MULTILINE,
+)
+_RE_ITEM = re.compile(
+    rf'^(?P<indent>{_WS}*)(?:(?P<ul>[-*])|\d+\.){_WS}+(?P<text>[^\n]+)$',
+    re.MULTILINE,
+)
+# List environments indexed by list type (0 = itemize, 1 = enumerate)
+_LIST_BEGIN = ('\\begin{itemize}', '\\begin{enumerate}')
+_LIST_END = ('\\end{itemize}', '\\end{enumerate}')
+# Opening of the sectioning command for header levels 1-4
+_HEADER_OPEN = ('\\section{', '\\subsection{', '\\subsubsection{', '\\paragraph{')
+
+# Inline formatting: one alternation, leftmost match wins. Math spans are
+# tried first and kept verbatim; emphasis/code bodies step over math spans
+# as a unit, so their delimiters never pair with a `_` or `*` inside math.
+# Emphasis bodies likewise step over whole spans of the other weight, and an
+# italic never closes on the first delimiter of a bold span, so `*a **b** c*`
+# and `**a *b***` nest the way the old bold-then-italic passes did; an
+# italic that opens with a bold span (`***a** b*`) is tried before bold.
+# Bold/italic bodies are formatted recursively and the literal text between
+# matches only gets % escaped.
+_MATH = r'\\\(.*?\\\)|\\\[.*?\\\]|\$\$.*?\$\$|\$[^$]+\$'
+_BODY = rf'(?:{_MATH}|(?!{_MATH}).)+?'
+_BOLD = rf'\*\*{_BODY}\*\*|__{_BODY}__'
+_ITALIC = rf'\*(?!\*){_BODY}\*|_(?!_){_BODY}_'
+_BOLD_BODY = rf'(?:{_MATH}|{_ITALIC}|(?!{_MATH}).)+?'
+_ITALIC_BODY = rf'(?:{_MATH}|{_BOLD}|(?!{_MATH}|{_BOLD}).)+?'
+_RE_MATH = re.compile(_MATH)
+_RE_INLINE = re.compile(
+    rf'(?P<math>{_MATH})'
+    rf'|\*\*\*(?P<bis>{_BODY})\*\*\*'
+    rf'|___(?P<biu>{_BODY})___'
+    rf'|\*(?P<is_lead>(?:\*\*{_BODY}\*\*){_ITALIC_BODY})\*'
+    rf'|_(?P<iu_lead>(?:__{_BODY}__){_ITALIC_BODY})_'
+    rf'|\*\*(?P<bs>{_BOLD_BODY})\*\*'
+    rf'|__(?P<bu>{_BOLD_BODY})__'
+    rf'|\*(?P<is_>{_ITALIC_BODY})(?!\*\*{_BODY}\*\*)\*'
+    rf'|_(?P<iu>{_ITALIC_BODY})(?!__{_BODY}__)_'
+    rf'|`(?P<code>{_BODY})`'
+)
+# Any character that convert_inline can act on; plain prose skips the work
+_RE_HAS_META = re.compile(r'[*_`$%\\]')
+# LaTeX specials escaped in non-math text; only % for now
+_LATEX_ESCAPE = str.maketrans({'%': '\\%'})
+# Code spans are literal, so text-mode specials that would break the build
+# are escaped there as well
+_CODE_ESCAPE = str.maketrans({'%': '\\%', '_': '\\_', '#': '\\#', '&': '\\&'})
+
+def _block_lines(block):
+    if block.endswith('\n'):
+        block = block[:-1]
+    return block.split('\n')
 
 def convert(md):
-    lines = md.split('\n')
     out = []
-    list_stack = []  # stack of ('ul'|'ol', indent_level)
-    in_table = False
-    table_rows = []
+    # Bound methods used in the hot loops; fixed multi-line chunks go in with
+    # a single extend() so the list grows once per chunk
+    append = out.append
+    extend = out.extend
+    # Open lists as parallel stacks: indent level and list type (0=ul, 1=ol)
+    indent_stack = []
+    type_stack = bytearray()
     
-    def get_indent(line):
-        return len(line) - len(line.lstrip())
+    def blank(count=1):
+        # Never more than 2 blank lines in a row (keep 2 blank lines before sections)
+        for _ in range(count):
+            if len(out) > 1 and not out[-1] and not out[-2]:
+                return
+            append('')
     
     def close_lists_to_level(target_indent):
-        while list_stack and list_stack[-1][1] >= target_indent:
-            list_type, _ = list_stack.pop()
-            if list_type == 'ul':
-                out.append('\\end{itemize}')
-            else:
-                out.append('\\end{enumerate}')
-            if not list_stack:  # add blank after outermost list closes
-                out.append('')
+        while indent_stack and indent_stack[-1] >= target_indent:
+            indent_stack.pop()
+            append(_LIST_END[type_stack.pop()])
+            if not indent_stack:  # add blank after outermost list closes
+                blank()
     
     def close_all_lists():
         close_lists_to_level(0)
     
-    def flush_table():
-        nonlocal in_table, table_rows
+    def emit_table(block):
+        table_rows = []
+        for line in _block_lines(block):
+            cells = [c.strip() for c in line.strip()[1:-1].split('|')]
+            # Skip separator rows (|---|---|): every cell non-empty, only - and :
+            if all(c and not c.strip('-:') for c in cells):
+                continue
+            if not table_rows:
+                close_all_lists()
+            table_rows.append([convert_inline(c) for c in cells])
         if not table_rows:
             return
         ncols = len(table_rows[0])
-        out.append('')
-        out.append('\\begin{table}[h]')
-        out.append('\\centering')
-        out.append('\\begin{tabular}{' + 'l' * ncols + '}')
-        out.append('\\hline')
+        blank()
+        extend(('\\begin{table}[h]', '\\centering',
+                '\\begin{tabular}{' + 'l' * ncols + '}', '\\hline'))
         for i, row in enumerate(table_rows):
-            out.append(' & '.join(row) + ' \\\\')
+            append(' & '.join(row) + ' \\\\')
             if i == 0:  # header
-                out.append('\\hline')
-        out.append('\\hline')
-        out.append('\\end{tabular}')
-        out.append('\\end{table}')
-        out.append('')
-        table_rows = []
-        in_table = False
+                append('\\hline')
+        extend(('\\hline', '\\end{tabular}', '\\end{table}'))
+        blank()
+    
+    def emit_list(block):
+        push_indent, pop_indent = indent_stack.append, indent_stack.pop
+        push_type, pop_type = type_stack.append, type_stack.pop
+        for item in _RE_ITEM.finditer(block):
+            list_type = 0 if item.group('ul') else 1
+            indent = len(item.group('indent'))
+            # Close deeper nested lists
+            while indent_stack and indent_stack[-1] > indent:
+                pop_indent()
+                append(_LIST_END[pop_type()])
+            # Start new list if no list or this is nested deeper
+            if not indent_stack or indent > indent_stack[-1]:
+                if not indent_stack:  # only add blank line for top-level list
+                    blank()
+                append(_LIST_BEGIN[list_type])
+                push_indent(indent)
+                push_type(list_type)
+            append(f'\\item {convert_inline(item.group("text"))}')
     
-    i = 0
-    while i < len(lines):
-        line = lines[i]
+    for m in _RE_BLOCK.finditer(md):
+        kind = m.lastgroup
         
-        # Table row
-        if line.strip().startswith('|') and line.strip().endswith('|'):
-            cells = [c.strip() for c in line.strip()[1:-1].split('|')]
-            # Skip separator rows (|---|---|)
-            if all(re.match(r'^[-:]+$', c) for c in cells):
-                i += 1
-                continue
-            if not in_table:
-                close_all_lists()
-                in_table = True
-            table_rows.append([convert_inline(c) for c in cells])
-            i += 1
-            continue
-        elif in_table:
-            flush_table()
+        if kind == 'tbl':
+            emit_table(m.group('tbl'))
         
         # Headers
-        if m := re.match(r'^(#{1,4})\s+(.+)$', line):
+        elif kind == 'hdr':
             close_all_lists()
-            level = len(m.group(1))
-            title = convert_inline(m.group(2))
-            cmd = ['\\section', '\\subsection', '\\subsubsection', '\\paragraph'][level-1]
-            out.append('')
-            out.append('')
-            out.append(f'{cmd}{{{title}}}')
-            i += 1
-            continue
+            level = len(m.group('hdr_level'))
+            title = convert_inline(m.group('hdr_text'))
+            blank(2)
+            append(_HEADER_OPEN[level-1] + title + '}')
         
-        # Unordered list
-        if m := re.match(r'^(\s*)[-*]\s+(.+)$', line):
-            indent = get_indent(line)
-            # Close deeper nested lists
-            while list_stack and list_stack[-1][1] > indent:
-                list_type, _ = list_stack.pop()
-                out.append('\\end{itemize}' if list_type == 'ul' else '\\end{enumerate}')
-            # Start new list if no list or this is nested deeper
-            if not list_stack or indent > list_stack[-1][1]:
-                if not list_stack:  # only add blank line for top-level list
-                    out.append('')
-                out.append('\\begin{itemize}')
-                list_stack.append(('ul', indent))
-            out.append(f'\\item {convert_inline(m.group(2))}')
-            i += 1
-            continue
-        
-        # Ordered list
-        if m := re.match(r'^(\s*)\d+\.\s+(.+)$', line):
-            indent = get_indent(line)
-            # Close deeper nested lists
-            while list_stack and list_stack[-1][1] > indent:
-                list_type, _ = list_stack.pop()
-                out.append('\\end{itemize}' if list_type == 'ul' else '\\end{enumerate}')
-            # Start new list if no list or this is nested deeper
-            if not list_stack or indent > list_stack[-1][1]:
-                if not list_stack:  # only add blank line for top-level list
-                    out.append('')
-                out.append('\\begin{enumerate}')
-                list_stack.append(('ol', indent))
-            out.append(f'\\item {convert_inline(m.group(2))}')
-            i += 1
-            continue
+        elif kind == 'list':
+            emit_list(m.group('list'))
         
         # Image
-        if m := re.match(r'^!\[.*?\]\((.+?)\)$', line.strip()):
+        elif kind == 'img':
             close_all_lists()
-            out.append('')
-            out.append('\\begin{figure}[h]')
-            out.append('\\centering')
-            out.append(f'\\includegraphics[width=\\textwidth]{{{m.group(1)}}}')
-            out.append('\\end{figure}')
-            out.append('')
-            i += 1
-            continue
+            blank()
+            extend(('\\begin{figure}[h]', '\\centering',
+                    f'\\includegraphics[width=\\textwidth]{{{m.group("img_src")}}}',
+                    '\\end{figure}'))
+            blank()
         
-        # Empty line - skip if inside a list
-        if not line.strip():
-            if not list_stack:
-                out.append('')
-            i += 1
-            continue
+        # Empty lines - skip if inside a list
+        elif kind == 'blank':
+            if not indent_stack:
+                blank(len(_block_lines(m.group('blank'))))
         
         # Regular paragraph - close lists before adding
-        close_all_lists()
-        out.append(convert_inline(line))
-        i += 1
+        else:
+            close_all_lists()
+            extend(convert_inline(line) for line in _block_lines(m.group('para')))
     
     close_all_lists()
-    flush_table()
     
-    # Collapse 4+ blank lines into 2 blank lines (keep 2 blank lines before sections)
-    result = '\n'.join(out)
-    result = re.sub(r'\n{4,}', '\n\n\n', result)
-    return result.strip()
+    return '\n'.join(out).strip()
+
+def _escape_code(text):
+    # Escape outside math spans only
+    parts = []
+    pos = 0
+    for m in _RE_MATH.finditer(text):
+        parts.append(text[pos:m.start()].translate(_CODE_ESCAPE))
+        parts.append(m.group(0))
+        pos = m.end()
+    parts.append(text[pos:].translate(_CODE_ESCAPE))
+    return ''.join(parts)
 
+def _inline_token(m):
+    kind = m.lastgroup
+    if kind == 'math':
+        return m.group(0)
+    if kind == 'code':
+        return '\\texttt{' + _escape_code(m.group('code')) + '}'
+    if kind in ('bis', 'biu'):
+        return '\\textbf{\\textit{' + convert_inline(m.group(kind)) + '}}'
+    if kind in ('bs', 'bu'):
+        return '\\textbf{' + convert_inline(m.group(kind)) + '}'
+    return '\\textit{' + convert_inline(m.group(kind)) + '}'
+
+# Table cells and list items repeat a lot; convert_inline is pure
+@lru_cache(maxsize=4096)
 def convert_inline(text):
-    # Protect math expressions from formatting changes
-    math_placeholders = []
-    def save_math(m):
-        math_placeholders.append(m.group(0))
-        return f'\x00MATH{len(math_placeholders)-1}\x00'
-    # Save inline and display math
-    text = re.sub(r'\\\(.*?\\\)', save_math, text)
-    text = re.sub(r'\\\[.*?\\\]', save_math, text)
-    text = re.sub(r'\$\$.*?\$\$', save_math, text)
-    text = re.sub(r'\$[^$]+\$', save_math, text)
-    
-    # Bold
-    text = re.sub(r'\*\*(.+?)\*\*', r'\\textbf{\1}', text)
-    text = re.sub(r'__(.+?)__', r'\\textbf{\1}', text)
-    # Italic
-    text = re.sub(r'\*(.+?)\*', r'\\textit{\1}', text)
-    text = re.sub(r'_(.+?)_', r'\\textit{\1}', text)
-    # Code
-    text = re.sub(r'`(.+?)`', r'\\texttt{\1}', text)
-    # Escape %
-    text = text.replace('%', '\\%')
-    
-    # Restore math expressions
-    for i, m in enumerate(math_placeholders):
-        text = text.replace(f'\x00MATH{i}\x00', m)
-    return text
+    if _RE_HAS_META.search(text) is None:
+        return text
+    parts = []
+    pos = 0
+    for m in _RE_INLINE.finditer(text):
+        parts.append(text[pos:m.start()].translate(_LATEX_ESCAPE))
+        parts.append(_inline_token(m))
+        pos = m.end()
+    parts.append(text[pos:].translate(_LATEX_ESCAPE))
+    return ''.join(parts)
 
 if __name__ == '__main__':
     if len(sys.argv) < 2:
@@ -181,4 +227,6 @@ if __name__ == '__main__':
         with open(sys.argv[1]) as f:
             md = f.read()
     
-    print(convert(md))
+    # Write the encoded result in one go, bypassing the text layer of stdout
+    sys.stdout.buffer.write(convert(md).encode('utf-8', errors='replace'))
+    sys.stdout.buffer.write(b'\n')
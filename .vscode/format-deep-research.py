@@ -16,6 +16,7 @@ ChatGPT Deep Research uses special Unicode markers (Private Use Area):
 import re
 import sys
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 
@@ -24,29 +25,57 @@ MARKER_START = '\ue200'   # Start of annotated element
 MARKER_END = '\ue201'     # End of annotated element
 MARKER_SEP = '\ue202'     # Content separator
 
-
-def format_entities(text: str) -> str:
-    """Find and replace all entity markers with formatted text."""
-    # Pattern: \ue200entity\ue202["type","name","desc"]\ue201
-    pattern = re.escape(MARKER_START) + r'entity' + re.escape(MARKER_SEP) + r'\[([^\]]+)\]' + re.escape(MARKER_END)
-    
-    def replace_entity(match):
-        content = match.group(1)
-        parts = re.findall(r'"([^"]*)"', content)
-        if len(parts) >= 2:
-            name = parts[1]
-            description = parts[2] if len(parts) > 2 else ""
-            if description:
-                return f"**{name}** ({description})"
-            return f"**{name}**"
-        return match.group(0)
-    
-    return re.sub(pattern, replace_entity, text)
-
-
-def format_citations(text: str, style: str = "remove") -> str:
+# The document is processed as UTF-8 bytes end to end (no decode/encode
+# round-trip), so all patterns below are bytes patterns
+_START = re.escape(MARKER_START.encode('utf-8'))
+_END = re.escape(MARKER_END.encode('utf-8'))
+_SEP = re.escape(MARKER_SEP.encode('utf-8'))
+
+# Body classes below exclude their own opener ([ or {) as well as the closer,
+# so a failed match stops at the next opener instead of rescanning to the end
+# of the document; matching stays linear even on unterminated openers.
+
+# Pattern: \ue200entity\ue202["type","name","desc"]\ue201
+# Name and description are the 2nd and 3rd quoted strings in the brackets
+ENTITY_PATTERN = (
+    _START + rb'entity' + _SEP
+    + rb'\[[^"\[\]]*"[^"\[\]]*"[^"\[\]]*"(?P<entity_name>[^"\[\]]*)"'
+    + rb'(?:[^"\[\]]*"(?P<entity_desc>[^"\[\]]*)")?[^\[\]]*\]' + _END
+)
+# Pattern: \ue200cite\ue202turn19search6\ue202turn19search5\ue201
+# Each repetition starts with the separator and digits can't be mistaken for
+# the following byte, so a failed match backtracks at most once per repetition
+CITATION_PATTERN = _START + rb'cite(?:' + _SEP + rb'turn\d+(?:search|view)\d+)+' + _END
+# image_group with Unicode markers and JSON content, or plain (without markers)
+IMAGE_GROUP_PATTERN = _START + rb'image_group' + _SEP + rb'\{[^{}]+\}' + _END
+IMAGE_GROUP_PLAIN_PATTERN = rb'image_group\{[^{}]+\}'
+
+# All annotated elements in one alternation, so the document is scanned once
+DEEP_RESEARCH_PATTERN = re.compile(
+    b'(?P<entity>' + ENTITY_PATTERN + b')'
+    b'|(?P<cite>' + CITATION_PATTERN + b')'
+    b'|(?P<image_group>' + IMAGE_GROUP_PATTERN + b'|' + IMAGE_GROUP_PLAIN_PATTERN + b')'
+)
+
+# Whitespace cleanup in one pass: 3+ newlines, trailing spaces on a line,
+# spaces before punctuation (left behind by removed citations).
+# Space runs only match from their first space: without the lookbehind a
+# long run followed by other text is retried from every position (quadratic).
+WHITESPACE_PATTERN = re.compile(rb'(\n{3,})|(?<! ) +$|(?<! ) +(?=[.,;:!?])', re.MULTILINE)
+
+
+def replace_entity(match: re.Match) -> bytes:
+    """Format a single entity match as **name** (description)."""
+    name = match.group('entity_name')
+    description = match.group('entity_desc')
+    if description:
+        return b"**" + name + b"** (" + description + b")"
+    return b"**" + name + b"**"
+
+
+def citation_replacer(style: str = "remove"):
     """
-    Handle citation markers with Unicode delimiters.
+    Return a re.sub callback rendering a citation match in the given style.
     Format: \ue200cite\ue202turn19search6\ue202turn19search5\ue201
     
     Styles:
@@ -54,57 +83,39 @@ def format_citations(text: str, style: str = "remove") -> str:
     - 'footnote': Convert to numbered footnote style [1]
     - 'bracket': Convert to bracketed reference [cite]
     """
-    # Pattern matches the full citation block including Unicode markers
-    pattern = re.escape(MARKER_START) + r'cite(?:' + re.escape(MARKER_SEP) + r'turn\d+(?:search|view)\d+)+' + re.escape(MARKER_END)
-    
     if style == "remove":
-        return re.sub(pattern, '', text)
+        return lambda m: b''
     elif style == "footnote":
         counter = [0]
         def replace_with_number(m):
             counter[0] += 1
-            return f"[{counter[0]}]"
-        return re.sub(pattern, replace_with_number, text)
+            return b"[%d]" % counter[0]
+        return replace_with_number
     elif style == "bracket":
-        return re.sub(pattern, '[cite]', text)
-    return text
+        return lambda m: b'[cite]'
+    return lambda m: m.group(0)
 
 
-def remove_image_groups(text: str, replacement: str = "") -> str:
-    """Remove or replace image_group{...} blocks."""
-    # Pattern matches image_group with possible Unicode markers and JSON content
-    # First try with Unicode markers
-    pattern_with_markers = re.escape(MARKER_START) + r'image_group' + re.escape(MARKER_SEP) + r'\{[^}]+\}' + re.escape(MARKER_END)
-    text = re.sub(pattern_with_markers, replacement, text)
-    
-    # Also try plain image_group (without markers)
-    pattern_plain = r'image_group\{[^}]+\}'
-    text = re.sub(pattern_plain, replacement, text)
-    
-    return text
-
-
-def clean_extra_whitespace(text: str) -> str:
+def clean_extra_whitespace(text: bytes) -> bytes:
     """Clean up extra whitespace left after removals."""
-    # Remove multiple consecutive blank lines (keep max 2)
-    text = re.sub(r'\n{3,}', '\n\n', text)
-    # Remove trailing spaces on lines
-    text = re.sub(r' +$', '', text, flags=re.MULTILINE)
-    # Remove spaces before punctuation (from removed citations)
-    text = re.sub(r' +([.,;:!?])', r'\1', text)
-    return text
+    # Blank-line runs collapse to one (max 2 newlines); the other branches are dropped
+    return WHITESPACE_PATTERN.sub(lambda m: b'\n\n' if m.group(1) else b'', text)
 
 
-def format_deep_research(content: str, citation_style: str = "remove") -> str:
+def format_deep_research(content: bytes, citation_style: str = "remove") -> bytes:
     """Apply all formatting transformations."""
-    # Format entity markers
-    content = format_entities(content)
+    replace_citation = citation_replacer(citation_style)
     
-    # Handle citations
-    content = format_citations(content, citation_style)
+    # Format entities, handle citations and remove image groups in one pass
+    def replace_element(match):
+        kind = match.lastgroup
+        if kind == 'entity':
+            return replace_entity(match)
+        if kind == 'cite':
+            return replace_citation(match)
+        return b''
     
-    # Remove image groups
-    content = remove_image_groups(content)
+    content = DEEP_RESEARCH_PATTERN.sub(replace_element, content)
     
     # Clean up whitespace
     content = clean_extra_whitespace(content)
@@ -112,6 +123,14 @@ def format_deep_research(content: str, citation_style: str = "remove") -> str:
     return content
 
 
+def format_file(input_path: Path, output_path: Path, citation_style: str = "remove") -> Path:
+    """Format one markdown file and write the result to output_path."""
+    # Normalize line endings like read_text() did, so the cleanup sees plain \n
+    content = input_path.read_bytes().replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+    output_path.write_bytes(format_deep_research(content, citation_style))
+    return output_path
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Format ChatGPT Deep Research markdown for PDF conversion"
@@ -119,12 +138,13 @@ def main():
     parser.add_argument(
         "input",
         type=Path,
-        help="Input markdown file"
+        nargs="+",
+        help="Input markdown file(s)"
     )
     parser.add_argument(
         "-o", "--output",
         type=Path,
-        help="Output file (default: input-formatted.md)"
+        help="Output file (default: input-formatted.md; single input only)"
     )
     parser.add_argument(
         "--citations",
@@ -135,27 +155,44 @@ def main():
     parser.add_argument(
         "--inplace",
         action="store_true",
-        help="Modify the input file in place"
+        help="Modify the input file(s) in place"
+    )
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=1,
+        help="Number of worker processes for multiple inputs (default: 1)"
     )
     
     args = parser.parse_args()
     
-    if not args.input.exists():
-        print(f"Error: File '{args.input}' not found", file=sys.stderr)
-        sys.exit(1)
+    if args.output and len(args.input) > 1:
+        parser.error("--output can only be used with a single input file")
+    
+    for input_path in args.input:
+        if not input_path.exists():
+            print(f"Error: File '{input_path}' not found", file=sys.stderr)
+            sys.exit(1)
     
-    content = args.input.read_text(encoding="utf-8")
-    formatted = format_deep_research(content, args.citations)
+    jobs = []
+    for input_path in args.input:
+        if args.inplace:
+            output_path = input_path
+        elif args.output:
+            output_path = args.output
+        else:
+            output_path = input_path.with_stem(input_path.stem + "-formatted")
+        jobs.append((input_path, output_path, args.citations))
     
-    if args.inplace:
-        output_path = args.input
-    elif args.output:
-        output_path = args.output
+    # Files are independent, so a batch can be spread over worker processes
+    if args.jobs > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            written = list(executor.map(format_file, *zip(*jobs)))
     else:
-        output_path = args.input.with_stem(args.input.stem + "-formatted")
+        written = [format_file(*job) for job in jobs]
     
-    output_path.write_text(formatted, encoding="utf-8")
-    print(f"Formatted output written to: {output_path}")
+    for output_path in written:
+        print(f"Formatted output written to: {output_path}")
 
 
 if __name__ == "__main__":